@@ -1,15 +1,51 @@
+from . import command
 from . import formatter
 from . import utilities
 
+import asyncio
+import concurrent.futures
 import discord
+import functools
 import inspect
+import io
+import itertools
 import json
 import logging
+import logging.handlers
+import operator
 import os
 import pathlib
+import queue
 import re
+import sys
 import time
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+# Splits camelCase action names into the words of their snake_case method names.
+CAMEL_CASE_PATTERN = re.compile(r"(?<!^)(?=[A-Z])")
+
+# The spellings of each comparator that resolver leaves accept.
+EQUALS_COMPARATORS = frozenset({"equals", "exact", "is"})
+REGEX_COMPARATORS = frozenset({"expr", "like", "regex"})
+
+# The placeholder in embed descriptions that stands for the command prefix.
+PREFIX_TOKEN = "${PREFIX}"
+
+# Unpacks the arguments of actions that run on every invocation.
+GET_CHANNEL_ARGS = utilities.get_default("name", "duplicate", "sort_category")
+
+# Reads the name of each location scope from a resolver context.
+SCOPE_GETTERS = {
+    "category": operator.attrgetter("category_name"),
+    "channel": operator.attrgetter("channel_name"),
+    "server": operator.attrgetter("guild_name"),
+}
+
 
 class Client(discord.Client):
     def __init__(self, *, options, logging_level):
@@ -21,44 +57,46 @@ class Client(discord.Client):
         self.format = formatter.ColourFormatter()
         self.handle = logging.StreamHandler()
 
-        self.logger.addHandler(self.handle)
+        # Records are handed to a background thread that owns the stream, so that
+        # logging never blocks the event loop on a write.
+        self.log_queue = queue.SimpleQueue()
+        self.log_listener = logging.handlers.QueueListener(
+            self.log_queue, self.handle, respect_handler_level=True
+        )
+
+        # Tracebacks are rendered before records are queued, so they are coloured there; the listener adds the rest.
+        queue_handler = logging.handlers.QueueHandler(self.log_queue)
+        queue_handler.setFormatter(formatter.QueueFormatter())
+        self.logger.addHandler(queue_handler)
         self.handle.setFormatter(self.format)
 
         self.logger.setLevel(logging_level)
         self.handle.setLevel(logging_level)
+        self.log_listener.start()
 
         if logging_level == logging.DEBUG:
             self.logger.warn("Running in debugging mode!")
 
         # Configure the client as provided by the library.
-        super_opts = {
-            k: v
-            for k, v in options.items()
-            if k
-            in [
-                p.name
-                for p in inspect.signature(
-                    super(Client, self).__init__
-                ).parameters.values()
-            ]
-        }
+        super_opts = {k: options[k] for k in options.keys() & SUPER_PARAMS}
         intents = discord.Intents.default()
         intents.message_content = True
         super().__init__(intents=intents, **super_opts)
 
         # Add custom configuration options belonging to the subclass.
-        self_opts = {
-            k: v
-            for k, v in options.items()
-            if k
-            in [
-                p.name
-                for p in inspect.signature(self.configure_options).parameters.values()
-            ]
-        }
+        self_opts = {k: options[k] for k in options.keys() & CONFIG_PARAMS}
         self.configure_options(**self_opts)
 
-        self.camel_case_pattern = re.compile(r"(?<!^)(?=[A-Z])")
+        # Every builtin action, by method name; the private actions cannot be invoked by commands.
+        self.builtin_actions = {
+            name: getattr(self, name)
+            for name in dir(type(self))
+            if name.startswith("action_") and not name.startswith("action__")
+        }
+
+        self.command_cache = {}
+        self.command_queue = asyncio.Queue(maxsize=self.command_queue_size)
+        self.command_tasks = []
         self.load_state()
         self.create_command_library()
 
@@ -75,7 +113,7 @@ class Client(discord.Client):
         The null action.
         """
 
-        self.logger.error("No such action `{k}`!".format(k=function_name))
+        self.logger.error("No such action `%s`!", function_name)
         return False
 
     async def action_create_channel_in_category(self, function_name, msg, args, cmdargs):
@@ -89,46 +127,53 @@ class Client(discord.Client):
 
         if not msg.channel.category:
             self.logger.warn(
-                "You cannot call `{}` in a channel with no parent category!".format(
-                    function_name
-                )
+                "You cannot call `%s` in a channel with no parent category!", function_name
             )
-            return
+            return False
 
-        name, duplicate, sort_category = utilities.get_default(
-            "name", "duplicate", "sort_category"
-        )(args)
+        name, duplicate, sort_category = GET_CHANNEL_ARGS(args)
         parent, channel_list = msg.channel.category, msg.channel.category.channels
 
-        if duplicate and name in map(lambda ch: ch.name, channel_list):
-            return
+        # Refusing to duplicate a channel fails the command, so it neither responds nor runs later actions.
+        if not duplicate and name in {ch.name for ch in channel_list}:
+            self.logger.debug("Channel %s already exists in %s.", name, parent.name)
+            return False
 
         # We add the channel using the permission scheme of the parent category.
         new_channel = await parent.create_text_channel(
             name, overwrites=parent.overwrites
         )
-        self.logger.info("Created channel {} in {}.".format(name, parent.name))
+        self.logger.info("Created channel %s in %s.", name, parent.name)
 
         if not sort_category:
-            return
+            return True
 
-        # Else, we need to sort the channels in the category alphabetically.
-        sorted_channels = sorted(
-            new_channel.category.channels, key=(lambda ch: ch.name)
-        )
-        for index, channel in enumerate(sorted_channels):
-            if index == 0:
-                self.logger.debug(
-                    "Moved channel {} to the top of {}.".format(channel.name, parent)
-                )
-                await channel.move(beginning=True, category=parent)
-            else:
-                self.logger.debug(
-                    "Moved channel {} right below previous channel {}.".format(
-                        channel.name, sorted_channels[index - 1].name
-                    )
-                )
-                await channel.move(after=sorted_channels[index - 1], category=parent)
+        # Else, we need to sort the channels in the category alphabetically. Positions are
+        # shared by every channel in the guild's sorting bucket, so the category's channels
+        # trade the slots they already occupy, and the new ordering is sent in one request.
+        bucket = [
+            ch
+            for ch in parent.guild.channels
+            if ch._sorting_bucket == new_channel._sorting_bucket and ch.id != new_channel.id
+        ]
+        bucket.append(new_channel)
+        bucket.sort(key=operator.attrgetter("position", "id"))
+
+        slots = [index for index, ch in enumerate(bucket) if ch.category_id == parent.id]
+        sorted_channels = [bucket[index] for index in slots]
+        sorted_channels.sort(key=operator.attrgetter("name"))
+        for index, channel in zip(slots, sorted_channels):
+            bucket[index] = channel
+
+        # Only send the channels that actually move.
+        payload = [
+            {"id": ch.id, "position": index}
+            for index, ch in enumerate(bucket)
+            if ch.position != index
+        ]
+        if payload:
+            await self.http.bulk_channel_update(parent.guild.id, payload)
+        self.logger.debug("Sorted %s channels in %s.", len(sorted_channels), parent.name)
 
         return True
 
@@ -137,15 +182,14 @@ class Client(discord.Client):
         Determines whether or not to delete command invocations in your channel.
         """
         
-        declutter = cmdargs[0]
+        declutter = cmdargs[0].lower() if cmdargs else None
         if declutter in ['true', 'yes', 'y', 'on']:
             mode = "on"
             if msg.channel.id not in self.delete:
                 self.delete.add(msg.channel.id)
         else:
             mode = "off"
-            if msg.channel.id in self.delete:
-                self.delete.pop(msg.channel.id)
+            self.delete.discard(msg.channel.id)
         
         await msg.channel.send(embed=discord.Embed.from_dict(
             {"description": ":white_check_mark: Turned {} command deletion.".format(mode)}
@@ -159,12 +203,14 @@ class Client(discord.Client):
         """
 
         if msg.author.id not in self.administrators:
-            await self.action__no_permission(function_name, msg, args)
-            self.logger.warn("User <@{}> tried to lockdown.".format(msg.author.id))
+            await self.action__no_permission(function_name, msg, args, cmdargs)
+            self.logger.warn("User <@%s> tried to lockdown.", msg.author.id)
             return
     
-        reloader = self.command_lists['reload']
-        self.command_lists = {"reload": reloader}
+        # Keep only the reloader, if there is one, so that a reload can undo the lockdown.
+        reloader = self.command_lists.get("reload", None)
+        self.command_lists = {"reload": reloader} if reloader is not None else {}
+        self.resolve_cache.clear()
 
         self.logger.warn("Lockdown; reload to unpause.")
         return True
@@ -175,8 +221,8 @@ class Client(discord.Client):
         """
 
         if msg.author.id not in self.administrators:
-            await self.action__no_permission(function_name, msg, args)
-            self.logger.warn("User <@{}> tried to shutdown.".format(msg.author.id))
+            await self.action__no_permission(function_name, msg, args, cmdargs)
+            self.logger.warn("User <@%s> tried to shutdown.", msg.author.id)
             return 
 
         await self.close()
@@ -188,17 +234,206 @@ class Client(discord.Client):
         """
 
         if msg.author.id not in self.administrators:
-            await self.action__no_permission(function_name, msg, args)
-            self.logger.warn("User <@{}> tried to reload.".format(msg.author.id))
+            await self.action__no_permission(function_name, msg, args, cmdargs)
+            self.logger.warn("User <@%s> tried to reload.", msg.author.id)
             return
 
         self.logger.warn("Reloading the command library while live!")
         self.create_command_library()
         return True
 
-    async def cmd_execute_actions(self, msg, actions, cmdargs):
+    async def close(self):
         """
-        Executes a list of builtin command actions, in the order given.
+        Closes the connection to Discord, then stops the command workers and flushes any pending log records.
+        """
+
+        # The library marks itself closed as soon as closing starts, so a second close, such as a concurrent
+        # shutdown, must not cancel the worker that is still closing.
+        if self.is_closed():
+            return
+
+        # A shutdown command closes the client from inside a worker, so that worker must not cancel itself.
+        try:
+            await super().close()
+
+            current = asyncio.current_task()
+            for task in self.command_tasks:
+                if task is not current:
+                    task.cancel()
+        finally:
+            self.log_listener.stop()
+
+    def cmd_compile_block_location(self, resolve):
+        """
+        Compiles a location leaf into a predicate. Raises if its regex is invalid.
+        """
+
+        scope, cmp, name = utilities.get_default("scope", "cmp", "name")(resolve)
+
+        scope_getter = SCOPE_GETTERS.get(str(scope).lower(), None)
+
+        if not scope_getter:
+            self.logger.error("Unknown scope %s.", scope)
+            return lambda context: False
+
+        if cmp in EQUALS_COMPARATORS:
+            return lambda context: scope_getter(context) == name
+
+        if cmp in REGEX_COMPARATORS:
+            pattern = re.compile(name)
+
+            def resolve_location(context):
+                # A channel outside of any category has no category name to match against.
+                actual_scope = scope_getter(context)
+                return actual_scope is not None and pattern.search(actual_scope) is not None
+
+            return resolve_location
+
+        self.logger.error("Unknown comparator %s.", cmp)
+        return lambda context: False
+
+    def cmd_compile_block_role(self, resolve):
+        """
+        Compiles a role leaf into a predicate. Raises if its regex is invalid.
+        """
+
+        op, name = utilities.get_default("cmp", "name")(resolve)
+
+        if op in EQUALS_COMPARATORS:
+            return lambda context: name in context.role_names
+
+        if op in REGEX_COMPARATORS:
+            search = re.compile(name).search
+            return lambda context: any(
+                search(role_name) is not None for role_name in context.role_names
+            )
+
+        self.logger.error("Unknown comparator %s.", op)
+        return lambda context: False
+
+    def cmd_compile_context(self, resolve):
+        """
+        Compiles the resolver of a command into a single predicate on the message context.
+        """
+
+        # The absence of a policy is the same as full policy.
+        if not resolve:
+            return lambda context: True
+
+        if not isinstance(resolve, dict):
+            self.logger.error("Top level resolver must be a dictionary.")
+            return lambda context: False
+
+        if "and" not in resolve and "or" not in resolve and "not" not in resolve:
+            self.logger.error("Top level resolver must be 'and', 'or' or 'not'.")
+
+        return self.cmd_compile_resolve(resolve)
+
+    def cmd_compile_resolve(self, resolve, op=None):
+        """
+        If the resolve scope is a list, compiles the operator over its children. If the resolve scope is a dict,
+        compiles the operator it holds, or the leaf it is.
+        """
+
+        if isinstance(resolve, list):
+            if op not in ["and", "or", "not"]:
+                self.logger.error("Unknown list operator %s.", op)
+                return lambda context: False
+
+            # Operators short-circuit, so try the cheapest checks first. Sort a copy, so that the configuration
+            # itself is left as written and identical commands still compare equal.
+            resolve = sorted(resolve, key=self.cmd_resolve_cost)
+
+            # Identical subtrees, even across commands, share one predicate, and so one memo entry.
+            key = json.dumps([op, resolve], sort_keys=True)
+            if key in self.resolve_predicates:
+                return self.resolve_predicates[key]
+
+            checks = tuple(self.cmd_compile_resolve(r) for r in resolve)
+            quantifier, negate = {"and": (all, False), "or": (any, False), "not": (any, True)}[op]
+
+            def resolve_memoized(context):
+                result = context.memo.get(resolve_memoized, None)
+                if result is None:
+                    result = quantifier(check(context) for check in checks) != negate
+                    context.memo[resolve_memoized] = result
+                return result
+
+            self.resolve_predicates[key] = resolve_memoized
+            return resolve_memoized
+
+        if not isinstance(resolve, dict):
+            self.logger.error("Unknown resolver block %s.", resolve)
+            return lambda context: False
+
+        # Is this a leaf or a node?
+        operators = [o for o in ["and", "or", "not"] if resolve.get(o, None)]
+
+        if len(operators) == 1:
+            return self.cmd_compile_resolve(resolve[operators[0]], operators[0])
+        elif len(operators) > 1:
+            self.logger.error("Ambiguous resolver block: too many operators!")
+            return lambda context: False
+
+        # Otherwise, there is no operator in this dict and thus it's a leaf.
+        handler = utilities.get_default("type")(resolve)
+        match handler:
+            case "location":
+                return self.cmd_compile_block_location(resolve)
+            case "role":
+                return self.cmd_compile_block_role(resolve)
+            case _:
+                self.logger.error("Unknown resolver leaf type %s.", handler)
+                return lambda context: False
+
+    async def cmd_dispatch(self, message, cmd, args, s):
+        """
+        Resolves and runs a queued command, then responds to it.
+        """
+
+        self.logger.debug("Command %s is a command; trying to resolve.", cmd)
+
+        # The library may have been reloaded or locked down while this command was queued.
+        candidates = self.command_lists.get(cmd, None)
+        if not candidates:
+            return
+
+        exec_config = await self.cmd_find_correct(message, cmd, self.command_index[cmd])
+        if not exec_config:
+            return
+
+        self.logger.debug("Resolved command %s to %s.", cmd, id(exec_config))
+
+        response, actions = exec_config.response, exec_config.actions
+
+        # Delete successful commands only.
+        # If a command failed due to context checks, do not even acknowledge it.
+        # This protects the identity of secret commands.
+        # The response and the deletion are independent requests, so their round trips overlap.
+        replies = []
+        if await self.cmd_execute_actions(message, actions, args, exec_config.parallel):
+            replies.append(self.cmd_send_response(message, response))
+        if message.channel.id in self.delete:
+            replies.append(message.delete())
+        await asyncio.gather(*replies)
+
+        f = time.perf_counter()
+
+        # Arguments are only interpolated if the record passes the logger's level.
+        user = message.author
+        author = f"{user.name}#{user.discriminator}"
+        self.logger.info(
+            "Successfully executed `%s%s <%s>` by %s. (took %.2fs)",
+            self.prefix,
+            cmd,
+            args,
+            author,
+            f - s,
+        )
+
+    async def cmd_execute_actions(self, msg, actions, cmdargs, parallel=False):
+        """
+        Executes a list of builtin command actions, in the order given, or all at once if they are parallel.
         """
 
         # Action lists are optional if the command doesn't have to do anything except
@@ -206,180 +441,308 @@ class Client(discord.Client):
         if not actions:
             return True
 
-        statuses = []
+        if parallel:
+            statuses = await asyncio.gather(
+                *(action.fn(action.name, msg, action.args, cmdargs) for action in actions)
+            )
+            return all(s for s in statuses)
 
+        # A failed action fails the command, so the actions after it are not run.
         for action in actions:
-            action_key, args = utilities.get_default("name", "args")(action)
-            function_name = await self.cmd_translate_action_key(action_key)
-            status = await getattr(self, function_name, "action__no_such_action")(
-                action_key, msg, args, cmdargs
-            )
-            statuses.append(status)
+            if not await action.fn(action.name, msg, action.args, cmdargs):
+                return False
 
-        return all(s for s in statuses)
+        return True
 
     async def cmd_find_correct(self, msg, cmd, candidates):
         """
-        Given a list of candidates for this command, find the correct one if it exists.
-        """
+        Given the indexed candidates for this command, find the correct one if it exists.
+        """
+
+        # The same author with the same roles in the same channel resolves the same way until something changes,
+        # so reuse recent verdicts. Keys are scoped by guild, so that verdicts never leak between servers, and by
+        # the author's current roles, so that gaining or losing a role takes effect on the very next message.
+        channel, author = msg.channel, msg.author
+        guild = channel.guild
+        key = (guild.id, channel.id, author.id, frozenset(r.id for r in author.roles), cmd)
+        now = time.monotonic()
+
+        cached = self.resolve_cache.get(key, None)
+        if cached and now - cached[0] < self.resolve_cache_ttl:
+            return cached[1]
+
+        # Snapshot what the resolvers read from the message, so every check shares one lookup of each.
+        category = channel.category
+        context = command.Context(
+            category_name=category.name if category else None,
+            channel_name=channel.name,
+            guild_name=guild.name,
+            role_names=frozenset(r.name for r in author.roles),
+            memo={},
+        )
 
-        valid_candidates = [
-            candidate
-            for candidate in candidates
-            if self.cmd_resolve_context(msg, candidate)
-        ]
+        # Candidates that only match one location by name are found by looking that name up.
+        literal, general = candidates
+        literal_matches = []
+        for scope, names in literal.items():
+            literal_matches.extend(names.get(SCOPE_GETTERS[scope](context), ()))
+
+        # Two valid candidates are already ambiguous, so stop resolving after the second.
+        valid_candidates = list(
+            itertools.islice(
+                itertools.chain(
+                    literal_matches,
+                    (c for c in general if self.cmd_resolve_context(context, c)),
+                ),
+                2,
+            )
+        )
+
+        # A cache size of zero turns caching off. Refreshing a key already in the cache never evicts another.
+        if len(valid_candidates) < 2 and self.resolve_cache_size > 0:
+            if key not in self.resolve_cache and len(self.resolve_cache) >= self.resolve_cache_size:
+                del self.resolve_cache[next(iter(self.resolve_cache))]
+            self.resolve_cache[key] = (now, valid_candidates[0] if valid_candidates else None)
 
         if len(valid_candidates) == 0:
             return None
         elif len(valid_candidates) == 1:
             return valid_candidates[0]
         else:
-            self.logger.error("Ambiguous command {} in context {}.".format(cmd, msg.id))
+            self.logger.error("Ambiguous command %s in context %s.", cmd, msg.id)
             await msg.send(
                 content=":x: Something went wrong... let a staff member know!"
             )
             return None
 
-    def cmd_resolve_block_location(self, context, resolve):
+    def cmd_literal_location(self, resolve):
         """
-        Resolves a location.
+        If a resolver does nothing but match one location exactly by name, returns that scope and name.
         """
 
+        if not isinstance(resolve, dict):
+            return None
+
+        operators = [o for o in ["and", "or", "not"] if resolve.get(o, None)]
+        if operators:
+            children = resolve[operators[0]]
+            if operators in [["and"], ["or"]] and isinstance(children, list) and len(children) == 1:
+                return self.cmd_literal_location(children[0])
+            return None
+
         scope, cmp, name = utilities.get_default("scope", "cmp", "name")(resolve)
+        if (
+            resolve.get("type", None) == "location"
+            and cmp in EQUALS_COMPARATORS
+            and str(scope).lower() in SCOPE_GETTERS
+            and isinstance(name, str)
+        ):
+            return str(scope).lower(), name
 
-        location_type = {
-            "category": "channel.category",
-            "channel": "channel",
-            "server": "channel.guild",
-        }.get(scope.lower(), None)
+        return None
 
-        if not location_type:
-            self.logger.error("Unknown scope {}.".format(scope))
-            return False
+    def cmd_load_file(self, path):
+        """
+        Loads the command configurations in a file, reusing the parsed result if the file is unchanged.
+        """
 
-        actual_scope = utilities.rgetattr(context, location_type).name
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
 
-        match cmp:
-            case "equals" | "exact" | "is":
-                return name == actual_scope
-            case "expr" | "like" | "regex":
-                try:
-                    return re.search(name, actual_scope) is not None
-                except Exception:
-                    self.logger.error("Invalid regex {}.".format(name))
-                    return False
+        cached = self.command_cache.get(path, None)
+        if cached and cached[0] == stamp:
+            return cached[1]
 
-        self.logger.error("Unknown comparator {}.".format(cmp))
-        return False
+        cmd_configs = utilities.read_json(path)
+
+        if isinstance(cmd_configs, dict):
+            cmd_configs = [cmd_configs]
+
+        commands = []
+        for config in cmd_configs:
+            # A command whose resolver cannot be compiled is never loaded, rather than failing per message.
+            try:
+                resolver = self.cmd_compile_context(config.get("resolve", None))
+            except re.error as e:
+                self.logger.fatal(
+                    "Skipped command %s in %s: invalid regex (%s).", config.get("aliases", None), path, e
+                )
+                continue
+            except (AttributeError, TypeError) as e:
+                self.logger.fatal(
+                    "Skipped command %s in %s: invalid resolver (%r).", config.get("aliases", None), path, e
+                )
+                continue
+
+            # Likewise, a command that is otherwise malformed is skipped, so that it cannot abort the whole load.
+            try:
+                commands.append(
+                    command.Command(
+                        aliases=config["aliases"],
+                        resolve=config.get("resolve", None),
+                        resolver=resolver,
+                        response=self.cmd_prepare_response(config.get("response", {})),
+                        actions=self.cmd_prepare_actions(config.get("actions", None)),
+                        parallel=bool(config.get("parallel", False)),
+                    )
+                )
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                self.logger.fatal(
+                    "Skipped command %s in %s: invalid configuration (%r).", config.get("aliases", None), path, e
+                )
 
-    def cmd_resolve_block_role(self, context, resolve):
+        self.command_cache[path] = (stamp, commands)
+        return commands
+
+    async def cmd_open_attachment(self, attachment):
         """
-        Resolves a role.
+        Reads an attachment, from the asset cache or in a worker thread, and wraps it as a file to upload.
         """
 
-        op, name = utilities.get_default("cmp", "name")(resolve)
+        # Popping and reinserting keeps the asset cache in least-recently-used order.
+        data = self.asset_cache.pop(attachment.path, None)
+        if data is None:
+            try:
+                data = await asyncio.to_thread(pathlib.Path(attachment.path).read_bytes)
+            except OSError:
+                self.logger.error("Invalid path %s.", attachment.path)
+                return None
+        else:
+            self.asset_cache_bytes -= len(data)
 
-        match op:
-            case "equals" | "exact" | "is":
-                return any(r.name == name for r in context.author.roles)
-            case "expr" | "like" | "regex":
-                try:
-                    return any(
-                        re.search(name, r.name) is not None
-                        for r in context.author.roles
-                    )
-                except Exception:
-                    self.logger.error("Invalid regex {}.".format(name))
-                    return False
+        if len(data) <= self.asset_cache_size and attachment.path not in self.asset_cache:
+            self.asset_cache[attachment.path] = data
+            self.asset_cache_bytes += len(data)
 
-        self.logger.error("Unknown comparator {}.".format(op))
-        return False
+            while self.asset_cache_bytes > self.asset_cache_size:
+                evicted = self.asset_cache.pop(next(iter(self.asset_cache)))
+                self.asset_cache_bytes -= len(evicted)
+
+        return discord.File(io.BytesIO(data), filename=attachment.name)
 
-    def cmd_resolve_recursive(self, context, resolve, op=None):
+    def cmd_prepare_actions(self, actions):
         """
-        If the resolve scope is a list, true if any(). If the resolve scope is a dict, true if all().
+        Binds each action in an action list to the method that implements it.
         """
 
-        if isinstance(resolve, list):
-            match op:
-                case "and":
-                    return all(self.cmd_resolve_recursive(context, r) for r in resolve)
-                case "or":
-                    return any(self.cmd_resolve_recursive(context, r) for r in resolve)
-                case "not":
-                    return not any(
-                        self.cmd_resolve_recursive(context, r) for r in resolve
-                    )
-                case _:
-                    self.logger.error("Unknown list operator {}.".format(op))
-                    return False
+        prepared = []
+        for action in actions or []:
+            name, args = utilities.get_default("name", "args")(action)
 
-        # Is this a leaf or a node?
-        _and, _or, _not = utilities.get_default("and", "or", "not")(resolve)
-        results = [r for r in [_and, _or, _not] if r]
-
-        if len(results) == 1:
-            if _and:
-                return self.cmd_resolve_recursive(context, resolve["and"], "and")
-            if _or:
-                return self.cmd_resolve_recursive(context, resolve["or"], "or")
-            if _not:
-                return self.cmd_resolve_recursive(context, resolve["not"], "not")
-        elif len(results) > 1:
-            self.logger.error("Ambiguous resolver block: too many operators!")
-            return False
+            # A nameless action fails whenever the command runs, just as an unknown one does.
+            if isinstance(name, str):
+                function_name = self.cmd_translate_action_key(name)
+            else:
+                self.logger.error("Action %s has no name.", action)
+                function_name = None
+
+            prepared.append(
+                command.Action(
+                    name=name,
+                    args=args,
+                    fn=self.builtin_actions.get(function_name, self.action__no_such_action),
+                )
+            )
 
-        # Otherwise, there is no operator in this dict and thus it's a leaf.
-        handler = utilities.get_default("type")(resolve)
-        match handler:
-            case "location":
-                return self.cmd_resolve_block_location(context, resolve)
-            case "role":
-                return self.cmd_resolve_block_role(context, resolve)
-            case _:
-                self.logger.error("Unknown resolver leaf type {}.".format(handler))
-                return False
+        return tuple(prepared)
 
-    def cmd_resolve_context(self, context, candidate):
+    def cmd_prepare_attachments(self, attachments):
         """
-        Resolves a context against a candidate.
+        Resolves each attachment against the asset path once, so that sending it touches the disk only to read it.
         """
 
-        resolve = utilities.get_default("resolve")(candidate)
+        asset_root = os.path.realpath(self.asset_path)
 
-        # The absence of a policy is the same as full policy.
-        if not resolve:
-            return True
+        prepared = []
+        for attachment in attachments or []:
+            path, name = utilities.get_default("path", "name")(attachment)
+            if not isinstance(path, str):
+                self.logger.error("Invalid path %s.", path)
+                continue
 
-        if not isinstance(resolve, dict):
-            self.logger.error("Top level resolver must be a dictionary.")
-            return False
+            real_path = os.path.realpath(os.path.join(self.asset_path, path))
 
-        if "and" not in resolve and "or" not in resolve and "not" in resolve:
-            self.logger.error("Top level resolver must be 'and', 'or' or 'not'.")
+            # Never send files from outside the asset folder, whether by `..` or by symlink.
+            if os.path.commonpath([asset_root, real_path]) != asset_root:
+                self.logger.fatal("Refusing attachment %s outside of the asset path.", path)
+                continue
 
-        return self.cmd_resolve_recursive(context, resolve)
+            if not os.path.isfile(real_path):
+                self.logger.error("Invalid path %s.", real_path)
 
-    async def cmd_send_response(self, msg, response):
+            prepared.append(
+                command.Attachment(
+                    path=real_path, name=name or os.path.basename(real_path)
+                )
+            )
+
+        return tuple(prepared)
+
+    def cmd_prepare_response(self, response):
         """
-        Sends a response to the command invocation.
+        Builds the response of a command from its JSON specification.
         """
 
         r_type, attachments, content = utilities.get_default(
             "type", "attachments", "content"
         )(response)
 
-        files = []
+        # Embeds never change between invocations, so build them once; sending only reads them.
+        embeds = []
+        if r_type != "simple":
+            contents = [content] if isinstance(content, dict) else content or []
+
+            for embed_content in contents:
+                embed_content = dict(embed_content)
+                if "description" in embed_content:
+                    embed_content["description"] = embed_content["description"].replace(PREFIX_TOKEN, self.prefix)
+                embed = discord.Embed.from_dict(embed_content)
+                if "image" in embed_content:
+                    embed.set_image(url=embed_content["image"])
+                embeds.append(embed)
+
+        return command.Response(
+            type=r_type,
+            attachments=self.cmd_prepare_attachments(attachments),
+            content=content,
+            embeds=tuple(embeds),
+        )
+
+    def cmd_resolve_cost(self, resolve):
+        """
+        Ranks how expensive a resolver node is to check, from exact locations up to nested operators.
+        """
+
+        if not isinstance(resolve, dict) or any(op in resolve for op in ["and", "or", "not"]):
+            return 4
 
-        if attachments:
-            for attachment in attachments:
-                path, name = utilities.get_default("path", "name")(attachment)
-                path = os.path.join(self.asset_path, path)
-                try:
-                    with open(os.path.realpath(path), "rb") as fp:
-                        files.append(discord.File(fp, filename=name))
-                except Exception:
-                    self.logger.error("Invalid path {}.".format(path))
+        handler, cmp = utilities.get_default("type", "cmp")(resolve)
+        regex = 2 if cmp in REGEX_COMPARATORS else 0
+        return regex + (1 if handler == "role" else 0)
+
+    def cmd_resolve_context(self, context, candidate):
+        """
+        Resolves a context against a candidate.
+        """
+
+        return candidate.resolver(context)
+
+    async def cmd_send_response(self, msg, response):
+        """
+        Sends a response to the command invocation.
+        """
+
+        r_type, attachments, content = response.type, response.attachments, response.content
+        embeds = response.embeds
+
+        # Read every attachment concurrently, off the event loop.
+        files = [
+            file
+            for file in await asyncio.gather(
+                *(self.cmd_open_attachment(attachment) for attachment in attachments)
+            )
+            if file
+        ]
 
         if r_type == "simple":
             args = {"content": content}
@@ -388,23 +751,7 @@ class Client(discord.Client):
             await msg.channel.send(**args)
             return
 
-        # Then we know we're dealing with embeds.
-        if isinstance(content, dict):
-            contents = [content]
-        else:
-            contents = content
-
-        embeds = []
-        for content in contents:
-            if "description" in content:
-                content["description"] = re.sub(
-                    "\\$\\{PREFIX\\}", self.prefix, content['description']
-                )
-            embed = discord.Embed.from_dict(content)
-            if "image" in content:
-                embed.set_image(url=content["image"])
-            embeds.append(embed)
-
+        # Then we know we're dealing with embeds, which were built when the command was loaded.
         # Dynamically call the send function to support our responses.
         args = {}
         args.update({"file": files[0]} if len(files) == 1 else {"files": files})
@@ -412,19 +759,45 @@ class Client(discord.Client):
 
         await msg.channel.send(**args)
 
-    async def cmd_translate_action_key(self, action_key):
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def cmd_translate_action_key(action_key):
         """
         Takes a JSON action name and returns the name of the method corresponding to that function.
         """
-        return "action_" + self.camel_case_pattern.sub("_", action_key).lower()
+        return "action_" + CAMEL_CASE_PATTERN.sub("_", action_key).lower()
+
+    async def cmd_worker(self):
+        """
+        Runs queued commands one at a time, until the client closes.
+        """
+
+        while True:
+            message, cmd, args, s = await self.command_queue.get()
+            try:
+                await asyncio.wait_for(
+                    self.cmd_dispatch(message, cmd, args, s), timeout=self.command_timeout
+                )
+            except asyncio.TimeoutError:
+                self.logger.error("Command `%s%s` timed out.", self.prefix, cmd)
+            except Exception:
+                self.logger.exception("Command `%s%s` failed.", self.prefix, cmd)
+            finally:
+                self.command_queue.task_done()
 
     def configure_options(
         self,
         *,
         administrators=[],
+        asset_cache_size=64 * 1024 * 1024,
         asset_path="./assets/",
         command_path="./commands/",
+        command_queue_size=256,
+        command_timeout=30,
+        command_workers=4,
         prefix="?",
+        resolve_cache_size=4096,
+        resolve_cache_ttl=30,
         state_path="./configs/",
         token=None,
     ):
@@ -432,10 +805,17 @@ class Client(discord.Client):
         Configures the bot given a set of options.
         """
 
-        self.administrators = administrators
+        self.administrators = frozenset(administrators)
+        self.asset_cache_size = asset_cache_size
         self.asset_path = asset_path
         self.command_path = command_path
+        self.command_queue_size = command_queue_size
+        self.command_timeout = command_timeout
+        self.command_workers = command_workers
         self.prefix = prefix
+        self.prefix_lower = prefix.lower()
+        self.resolve_cache_size = resolve_cache_size
+        self.resolve_cache_ttl = resolve_cache_ttl
         self.state_path = state_path
         self.token = token
 
@@ -444,47 +824,63 @@ class Client(discord.Client):
         Using the command path, creates the custom commands from the JSON specifications.
         """
 
-        self.command_lists = {}
+        # Shared predicates are only looked up while compiling, so they can be dropped before loading.
+        self.resolve_predicates = {}
+        command_lists = {}
         collision = False
 
         s = time.perf_counter()
         # Recurse over the commands directory and find every JSON specifying a command.
         # Add the command to the library under every alias specified for that configuration.
-        for path in pathlib.Path(self.command_path).rglob("cmd-*.json"):
-            with open(path, "r") as f:
-                cmd_configs = json.load(f)
-
-                if isinstance(cmd_configs, dict):
-                    cmd_configs = [cmd_configs]
-
-                for config in cmd_configs:
-                    for alias in config["aliases"]:
-                        alias = alias.lower()
-
-                        if alias not in self.command_lists:
-                            self.command_lists.update({alias: [config]})
+        # Files are read and parsed in parallel, but merged in order so collisions are reported deterministically.
+        paths = list(utilities.find_files(self.command_path, "cmd-", ".json"))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, len(paths) or 1)) as executor:
+            loaded = list(executor.map(self.cmd_load_file, paths))
+
+        for cmd_configs in loaded:
+            for config in cmd_configs:
+                for alias in config.aliases:
+                    alias = sys.intern(alias.lower())
+
+                    if alias not in command_lists:
+                        command_lists.update({alias: [config]})
+                        self.logger.debug("Built new command: `%s%s`", self.prefix, alias)
+                    else:
+                        if not any(
+                            existing_command.resolve == config.resolve
+                            for existing_command in command_lists[alias]
+                        ):
+                            command_lists[alias].append(config)
                             self.logger.debug(
-                                "Built new command: `{}{}`".format(self.prefix, alias)
+                                "Name collision at %s%s.", self.prefix, alias
                             )
                         else:
-                            if not any(
-                                existing_command.get("resolve", None)
-                                == config.get("resolve", None)
-                                for existing_command in self.command_lists[alias]
-                            ):
-                                self.command_lists[alias].append(config)
-                                self.logger.debug(
-                                    "Name collision at {prefix}{alias}.".format(
-                                        **{"prefix": self.prefix, "alias": alias}
-                                    )
-                                )
-                            else:
-                                collision = True
-                                self.logger.error(
-                                    "True name and config collision at {prefix}{alias}!.".format(
-                                        **{"prefix": self.prefix, "alias": alias}
-                                    )
-                                )
+                            collision = True
+                            self.logger.error(
+                                "True name and config collision at %s%s!.", self.prefix, alias
+                            )
+
+        # Index each alias's candidates by the location they match exactly, where they only match one.
+        command_index = {}
+        for alias, candidates in command_lists.items():
+            literal, general = {}, []
+            for candidate in candidates:
+                location = self.cmd_literal_location(candidate.resolve)
+                if location:
+                    scope, name = location
+                    literal.setdefault(scope, {}).setdefault(name, []).append(candidate)
+                else:
+                    general.append(candidate)
+            command_index[alias] = (literal, general)
+
+        # The library is only replaced once it has loaded, so a failed reload leaves the running one in place.
+        self.asset_cache, self.asset_cache_bytes = {}, 0
+        self.command_lists, self.command_index = command_lists, command_index
+        self.resolve_cache = {}
+
+        # Forget any command files that have been deleted since the last load.
+        for path in self.command_cache.keys() - set(paths):
+            del self.command_cache[path]
         f = time.perf_counter()
 
         if collision:
@@ -492,16 +888,14 @@ class Client(discord.Client):
                 "Resolve naming collisions; overlapping commands might result in undefined behaviour."
             )
         else:
-            for k, v in self.command_lists.items():
-                self.logger.debug(
-                    "Loaded command {}. ({} resolver entr{})".format(
-                        k, len(v), "y" if len(v) == 1 else "ies"
+            # Listing every command is only worth the work when debugging.
+            if self.logger.isEnabledFor(logging.DEBUG):
+                for k, v in self.command_lists.items():
+                    self.logger.debug(
+                        "Loaded command %s. (%s resolver entr%s)", k, len(v), "y" if len(v) == 1 else "ies"
                     )
-                )
             self.logger.info(
-                "Loaded {n} commands successfully! (took {t:0.2f}s)".format(
-                    n=len(self.command_lists), t=f-s
-                )
+                "Loaded %s commands successfully! (took %.2fs)", len(self.command_lists), f - s
             )
 
     def load_state(self):
@@ -510,6 +904,27 @@ class Client(discord.Client):
         """
         self.delete = set()
 
+    async def on_guild_channel_update(self, before, after):
+        """
+        Channels are resolved by name, so a rename invalidates cached resolutions.
+        """
+
+        self.resolve_cache.clear()
+
+    async def on_guild_role_update(self, before, after):
+        """
+        Roles are resolved by name, so a rename invalidates cached resolutions.
+        """
+
+        self.resolve_cache.clear()
+
+    async def on_guild_update(self, before, after):
+        """
+        Servers are resolved by name, so a rename invalidates cached resolutions.
+        """
+
+        self.resolve_cache.clear()
+
     async def on_message(self, message):
         """
         Handles messages by looking them up in the command dictionary.
@@ -517,55 +932,65 @@ class Client(discord.Client):
 
         s = time.perf_counter()
 
-        # Only respond to messages inside servers.
-        if not message.channel.guild:
+        # Never respond to bots, ourselves included.
+        if message.author.bot:
             return
 
-        if not message.content.lower().startswith(self.prefix):
+        # Most messages are not commands, so reject them before anything else.
+        content, prefix_length = message.content, len(self.prefix_lower)
+        if content[:prefix_length].lower() != self.prefix_lower:
             return
 
-        # Get the command line formed from this command, after removing the prefix.
-        cmd_array = message.content.lower().removeprefix(self.prefix).split()
-        cmd, args = cmd_array[0], cmd_array[1:]
-
-        self.logger.debug("Received attempt at a command: `{} <{}>`".format(cmd, args))
-
-        if cmd not in self.command_lists:
+        # Only respond to messages inside servers.
+        if message.guild is None:
             return
 
-        self.logger.debug("Command {} is a command; trying to resolve.".format(cmd))
-
-        exec_config = await self.cmd_find_correct(message, cmd, self.command_lists[cmd])
-        if not exec_config:
+        # Get the command line formed from this command, after removing the prefix.
+        # Only the command name is case-insensitive; arguments keep their case.
+        # Any whitespace separates the command from its arguments, as it does between arguments.
+        cmdline = content[prefix_length:].split(None, 1)
+        if not cmdline:
             return
 
-        self.logger.debug("Resolved command {} to {}.".format(cmd, id(exec_config)))
+        # Aliases are interned when they are loaded, but typed commands are not, so that users cannot grow the
+        # interpreter's intern table.
+        cmd = cmdline[0].lower()
 
-        response, actions = utilities.get_default("response", "actions")(exec_config)
+        self.logger.debug("Received attempt at a command: `%s`", cmd)
 
-        if await self.cmd_execute_actions(message, actions, args):
-            await self.cmd_send_response(message, response)
+        if self.command_lists.get(cmd, None) is None:
+            return
 
-        f = time.perf_counter()
+        # Only split the arguments of messages that name a command.
+        args = cmdline[1].split() if len(cmdline) > 1 else []
 
-        self.logger.info(
-            "Succesfully executed `{pref}{cmd} <{args}>` by {name}. (took {t:0.2f}s)".format(
-                name=message.author.name + "#" + message.author.discriminator,
-                pref=self.prefix,
-                cmd=cmd,
-                args=args,
-                t=f - s,
-            )
-        )
-
-        # Delete successful commands only.
-        # If a command failed due to context checks, do not even acknowledge it.
-        # This protects the identity of secret commands.
-        if message.channel.id in self.delete:
-            await message.delete()
+        # Hand the command to a worker, so that a slow command cannot stall the gateway.
+        try:
+            self.command_queue.put_nowait((message, cmd, args, s))
+        except asyncio.QueueFull:
+            self.logger.warn("Command queue is full; dropped `%s%s`.", self.prefix, cmd)
 
     def run(self):
         """
         Starts the bot. This call is blocking, and all registrations and configurations should occur before running.
         """
+
+        # Prefer the libuv event loop when it is installed.
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
         super().run(self.token)
+
+    async def setup_hook(self):
+        """
+        Starts the command workers once the client has an event loop.
+        """
+
+        self.command_tasks = [
+            asyncio.create_task(self.cmd_worker()) for _ in range(self.command_workers)
+        ]
+
+
+# The keyword arguments accepted by the library client and by our own configuration, computed once.
+SUPER_PARAMS = frozenset(inspect.signature(discord.Client.__init__).parameters) - {"self"}
+CONFIG_PARAMS = frozenset(inspect.signature(Client.configure_options).parameters) - {"self"}
@@ -0,0 +1,62 @@
+import dataclasses
+import typing
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Action:
+    """
+    A builtin action, bound to the method that implements it.
+    """
+
+    name: str
+    args: dict
+    fn: typing.Callable
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Attachment:
+    """
+    A file sent alongside a response, with its path already resolved against the asset path.
+    """
+
+    path: str
+    name: str
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Response:
+    """
+    The message or embeds sent back when a command succeeds.
+    """
+
+    type: str
+    attachments: tuple
+    content: typing.Any
+    embeds: tuple
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Command:
+    """
+    A single command configuration, as loaded from a command file.
+    """
+
+    aliases: list
+    resolve: dict
+    resolver: typing.Callable
+    response: Response
+    actions: tuple
+    parallel: bool
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Context:
+    """
+    The parts of a message that resolvers read, snapshotted once per message.
+    """
+
+    category_name: typing.Optional[str]
+    channel_name: str
+    guild_name: str
+    role_names: frozenset
+    memo: dict
@@ -36,3 +36,21 @@ class ColourFormatter(logging.Formatter):
 
         record.exc_text = None
         return output
+
+
+class QueueFormatter(logging.Formatter):
+    def format(self, record):
+        """
+        Merges the message with its arguments before the record is queued, keeping tracebacks in colour.
+        """
+
+        message = record.getMessage()
+
+        # The queued record loses its exception info, so the colour formatter can no longer style the traceback.
+        if record.exc_info:
+            message = f"{message}\n\x1b[31m{self.formatException(record.exc_info)}\x1b[0m"
+
+        if record.stack_info:
+            message = f"{message}\n{self.formatStack(record.stack_info)}"
+
+        return message
@@ -1,4 +1,16 @@
 import functools
+import json
+import mmap
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Files larger than this are memory-mapped rather than read into a buffer.
+MMAP_THRESHOLD = 64 * 1024
 
 
 def rsetattr(obj, attr, val):
@@ -15,15 +27,33 @@ def rgetattr(obj, attr, *args):
     Recursively gets a property from an object, splitting on the dot.
     """
 
-    def _getattr(obj, attr):
-        return getattr(obj, attr, *args)
+    for part in split_attr(attr):
+        obj = getattr(obj, part, *args)
+    return obj
+
+
+def find_files(dirpath, prefix, suffix):
+    """
+    Recursively yields the paths of files under a directory whose names have the given prefix and suffix.
+    """
+
+    try:
+        entries = os.scandir(dirpath)
+    except FileNotFoundError:
+        return
 
-    return functools.reduce(_getattr, [obj] + attr.split("."))
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from find_files(entry.path, prefix, suffix)
+            elif entry.name.startswith(prefix) and entry.name.endswith(suffix) and entry.is_file():
+                yield entry.path
 
 
+@functools.cache
 def get_default(*items):
     """
-    Implements itemgetter with None fallback.
+    Implements itemgetter with None fallback. Getters are shared between callers asking for the same items.
     """
 
     if len(items) == 1:
@@ -35,6 +65,32 @@ def get_default(*items):
     else:
 
         def g(obj):
-            return tuple(obj.get(item, None) for item in items)
+            return tuple(map(obj.get, items))
 
     return g
+
+
+def read_json(path):
+    """
+    Parses a JSON file, with orjson if it is installed.
+    """
+
+    if orjson is None:
+        with open(path, "r") as f:
+            return json.load(f)
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= MMAP_THRESHOLD:
+            return orjson.loads(f.read())
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            return orjson.loads(view)
+
+
+@functools.cache
+def split_attr(attr):
+    """
+    Splits a dotted attribute path into its parts, remembering paths it has seen before.
+    """
+
+    return tuple(attr.split("."))